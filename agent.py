@@ -6,24 +6,155 @@ Enhanced Loop AI Agent with:
 """
 
 import os
+import threading
+import asyncio
+import logging
+from collections import deque
 from dotenv import load_dotenv
 from rag_engine import get_rag_engine
 import re
+import ahocorasick
+import cachetools
+import httpx
 import ollama
-from typing import List, Dict, Optional
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+HOSPITAL_KEYWORDS = frozenset(['hospital', 'clinic', 'medical', 'health', 'doctor', 'healthcare', 'network',
+                               'manipal', 'apollo', 'fortis', 'bangalore', 'delhi', 'location', 'address',
+                               'find', 'near', 'around', 'city', 'confirm', 'check', 'available', 'list', 'tell'])
+CONFIRMATION_KEYWORDS = frozenset(['confirm', 'is', 'check', 'verify'])
+FOLLOWUP_KEYWORDS = frozenset(['more', 'other', 'additional'])
+CONTEXT_CONFIRMATION_KEYWORDS = frozenset(['confirm', 'check', 'is'])
+CONTEXT_SEARCH_KEYWORDS = frozenset(['find', 'show', 'list', 'tell'])
+# Ordered: the first listed city/hospital found in the query wins
+CITIES = ('bangalore', 'bengaluru', 'delhi', 'mumbai', 'chennai', 'hyderabad', 'pune', 'kolkata')
+HOSPITAL_NAMES = ('manipal', 'apollo', 'fortis', 'max', 'medanta', 'artemis')
+# Spellings used for the same city in hospital.csv (e.g. 'New Delhi', 'Bengaluru')
+CITY_ALIASES = {'bangalore': ('bangalore', 'bengaluru'), 'bengaluru': ('bangalore', 'bengaluru')}
+
+KEYWORD_CATEGORIES = {
+    'hospital': HOSPITAL_KEYWORDS,
+    'confirmation': CONFIRMATION_KEYWORDS,
+    'followup': FOLLOWUP_KEYWORDS,
+    'context_confirmation': CONTEXT_CONFIRMATION_KEYWORDS,
+    'context_search': CONTEXT_SEARCH_KEYWORDS,
+    'city': CITIES,
+    'hospital_name': HOSPITAL_NAMES,
+}
+
+def _build_keyword_automaton():
+    word_categories = {}
+    for category, words in KEYWORD_CATEGORIES.items():
+        for word in words:
+            word_categories.setdefault(word, set()).add(category)
+    
+    automaton = ahocorasick.Automaton()
+    for word, categories in word_categories.items():
+        automaton.add_word(word, (word, frozenset(categories)))
+    automaton.make_automaton()
+    return automaton
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+LLM_ATTEMPT_TEMPERATURES = (0.5, 0.7, 0.9)
+LLM_SEED = 42
+# Keeps the model (and its prompt-prefix KV cache) resident between turns
+LLM_KEEP_ALIVE = '30m'
+ANSWER_CACHE_SIZE = 256
+ANSWER_CACHE_TTL = 600  # seconds
+# Requested result counts; longer digit runs are PIN codes or house numbers
+_NUM_RE = re.compile(r'\b(\d{1,2}|three|five|ten)\b', re.IGNORECASE)
+MAX_RESULT_COUNT = 10
+
+def _match_keywords(query_lower: str) -> Dict[str, set]:
+    """Single-pass substring scan returning {category: matched words}."""
+    matches = {}
+    for _, (word, categories) in _KEYWORD_AUTOMATON.iter(query_lower):
+        for category in categories:
+            matches.setdefault(category, set()).add(word)
+    return matches
+
+def _in_city(hospital_city, city: str) -> bool:
+    hospital_city = str(hospital_city).lower()
+    return any(alias in hospital_city for alias in CITY_ALIASES.get(city.lower(), (city.lower(),)))
+
+@lru_cache(maxsize=1024)
+def _is_hospital_query(query: str) -> bool:
+    return 'hospital' in _match_keywords(query.lower())
+
+@lru_cache(maxsize=1024)
+def _parse_intent(query: str) -> Tuple[str, Optional[str], Optional[str], int]:
+    """Memory-independent part of intent extraction: (type, city, hospital_name, count)."""
+    query_lower = query.lower()
+    matches = _match_keywords(query_lower)
+    intent_type, city, hospital_name, count = 'search', None, None, 3
+    
+    if 'confirmation' in matches:
+        intent_type = 'confirmation'
+    elif 'followup' in matches:
+        intent_type = 'followup'
+    
+    found_cities = matches.get('city', set())
+    for candidate in CITIES:
+        if candidate in found_cities:
+            city = candidate.capitalize()
+            break
+    
+    found_hospitals = matches.get('hospital_name', set())
+    for hosp in HOSPITAL_NAMES:
+        if hosp in found_hospitals:
+            hospital_name = hosp
+            break
+    
+    numbers = _NUM_RE.findall(query)
+    if numbers:
+        number = numbers[0].lower()
+        num_map = {'three': 3, 'five': 5, 'ten': 10}
+        count = int(number) if number.isdigit() else num_map.get(number, 3)
+        count = max(1, min(count, MAX_RESULT_COUNT))
+    
+    return intent_type, city, hospital_name, count
+
+# Byte-identical on every call so the server can reuse the cached prompt prefix;
+# per-turn context belongs in the user message
+SYSTEM_PROMPT = """You are Loop AI Health Assistant - a professional, empathetic hospital locator.
+
+CORE IDENTITY:
+- Name: Loop AI Health Assistant
+- Purpose: Help users find hospitals in the Loop Health network
+- Tone: Warm, professional, efficient
+
+RULES:
+1. ONLY answer hospital/healthcare facility queries
+2. For non-hospital topics: "I'm sorry, I can only assist with hospital queries. Let me connect you with a human agent."
+3. Use conversation history intelligently for follow-ups
+4. Keep responses CONCISE (2-4 sentences for voice clarity)
+5. Always mention city names with hospitals
+6. NO newlines or special characters in responses
+7. Be empathetic - healthcare decisions are important
+
+TOKEN EFFICIENCY:
+- Limit response to 60 tokens maximum
+- Use bullet points mentally but speak naturally
+- Prioritize essential information"""
+
 class ConversationMemory:
-    def __init__(self, max_history: int = 10):
-        self.history = []
+    def __init__(self, max_history: int = 10, on_clear=None):
+        self.history = deque(maxlen=max_history)
         self.max_history = max_history
         self.context = {}
+        # Last few exchanges pre-rendered for the prompt
+        self._recent_rendered = deque(maxlen=3)
+        # Called after clear() so anything derived from this memory can be dropped
+        self._on_clear = on_clear
     
     def add_interaction(self, user_query: str, ai_response: str, hospitals: List[Dict]):
         self.history.append({'user': user_query, 'assistant': ai_response, 'hospitals': hospitals})
-        if len(self.history) > self.max_history:
-            self.history = self.history[-self.max_history:]
+        self._recent_rendered.append(f"User: {user_query}\nAssistant: {ai_response}\n")
         self._update_context(user_query, hospitals)
     
     def _update_context(self, query: str, hospitals: List[Dict]):
@@ -31,29 +162,28 @@ class ConversationMemory:
             self.context['last_cities'] = list(set([h['city'] for h in hospitals]))
             self.context['last_hospital_names'] = [h['name'] for h in hospitals]
         
-        query_lower = query.lower()
-        if any(w in query_lower for w in ['confirm', 'check', 'is']):
+        matches = _match_keywords(query.lower())
+        if 'context_confirmation' in matches:
             self.context['last_intent'] = 'confirmation'
-        elif any(w in query_lower for w in ['find', 'show', 'list', 'tell']):
+        elif 'context_search' in matches:
             self.context['last_intent'] = 'search'
-        elif any(w in query_lower for w in ['more', 'other', 'additional']):
+        elif 'followup' in matches:
             self.context['last_intent'] = 'followup'
     
     def get_conversation_context(self) -> str:
-        if not self.history:
+        if not self._recent_rendered:
             return ""
-        recent = self.history[-3:]
-        context_str = "Previous conversation:\\n"
-        for interaction in recent:
-            context_str += f"User: {interaction['user']}\\nAssistant: {interaction['assistant']}\\n"
-        return context_str
+        return "Previous conversation:\n" + "".join(self._recent_rendered)
     
     def get_last_city(self) -> Optional[str]:
         return self.context.get('last_cities', [None])[0] if 'last_cities' in self.context else None
     
     def clear(self):
-        self.history = []
+        self.history.clear()
+        self._recent_rendered.clear()
         self.context = {}
+        if self._on_clear is not None:
+            self._on_clear()
 
 
 class LoopAIAgent:
@@ -61,81 +191,63 @@ class LoopAIAgent:
         self.rag_engine = get_rag_engine()
         self.ollama_host = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
         self.ollama_model = os.getenv('OLLAMA_MODEL', 'llama3.2')
-        self.memory = ConversationMemory()
         self.session_started = False
+        # Answer short city searches from a template instead of the LLM (toggle for A/B)
+        self.fast_path_enabled = True
+        self._client = None
+        self._client_loop = None
+        # (normalized query, last city) -> (answer, hospitals) for repeat questions
+        self._answer_cache = cachetools.TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+        # Cached answers were produced with the old context, so clearing memory drops them
+        self.memory = ConversationMemory(on_clear=self._answer_cache.clear)
         
-        self.system_prompt = """You are Loop AI Health Assistant - a professional, empathetic hospital locator.
-
-CORE IDENTITY:
-- Name: Loop AI Health Assistant
-- Purpose: Help users find hospitals in the Loop Health network
-- Tone: Warm, professional, efficient
-
-RULES:
-1. ONLY answer hospital/healthcare facility queries
-2. For non-hospital topics: "I'm sorry, I can only assist with hospital queries. Let me connect you with a human agent."
-3. Use conversation history intelligently for follow-ups
-4. Keep responses CONCISE (2-4 sentences for voice clarity)
-5. Always mention city names with hospitals
-6. NO newlines or special characters in responses
-7. Be empathetic - healthcare decisions are important
-
-TOKEN EFFICIENCY:
-- Limit response to 60 tokens maximum
-- Use bullet points mentally but speak naturally
-- Prioritize essential information"""
+        self.system_prompt = SYSTEM_PROMPT
         
         self.greeting_message = """Hello! I'm Loop AI Health Assistant, your dedicated guide to finding hospitals in the Loop Health network. I can help you locate hospitals by city, verify if specific facilities are in your network, and answer questions about our healthcare partners. How may I assist you today?"""
         
+        hospital_count = len(self.rag_engine.hospitals_df) if hasattr(self.rag_engine, 'hospitals_df') and self.rag_engine.hospitals_df is not None else 'unknown'
+        print(f"✅ Loop AI Health Assistant initialized")
+        print(f"   Model: {self.ollama_model}")
+        print(f"   RAG Database: {hospital_count} hospitals loaded")
+    
+    async def ollama_status(self) -> Dict:
+        """Probe the Ollama server; only called from the /health endpoint."""
         try:
-            models = ollama.list()
-            hospital_count = len(self.rag_engine.hospitals_df) if hasattr(self.rag_engine, 'hospitals_df') and self.rag_engine.hospitals_df is not None else 'unknown'
-            print(f"✅ Loop AI Health Assistant initialized")
-            print(f"   Model: {self.ollama_model}")
-            print(f"   RAG Database: {hospital_count} hospitals loaded")
-            print(f"   Available Ollama models: {len(models.get('models', []))}")
+            models = await self._get_client().list()
+            return {'reachable': True, 'model': self.ollama_model, 'available_models': len(models.get('models', []))}
         except Exception as e:
-            print(f"⚠️ Status check issue: {str(e)}")
-            print(f"   Agent initialized successfully with {self.ollama_model}")
+            return {'reachable': False, 'model': self.ollama_model, 'error': str(e)}
+    
+    def _get_client(self) -> ollama.AsyncClient:
+        # One pooled client per event loop; connections can't outlive the loop
+        # that opened them (process_query runs each call in a fresh loop)
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = ollama.AsyncClient(host=self.ollama_host, timeout=httpx.Timeout(30.0, connect=2.0))
+            self._client_loop = loop
+        return self._client
+    
+    def clear_memory(self):
+        self.memory.clear()
     
     def _is_hospital_related(self, query: str) -> bool:
-        keywords = ['hospital', 'clinic', 'medical', 'health', 'doctor', 'healthcare', 'network', 
-                    'manipal', 'apollo', 'fortis', 'bangalore', 'delhi', 'location', 'address',
-                    'find', 'near', 'around', 'city', 'confirm', 'check', 'available', 'list', 'tell']
-        return any(k in query.lower() for k in keywords)
+        return _is_hospital_query(query)
     
     def _extract_intent(self, query: str) -> Dict:
-        query_lower = query.lower()
-        intent = {'type': 'search', 'city': None, 'hospital_name': None, 'count': 3}
-        
-        if any(w in query_lower for w in ['confirm', 'is', 'check', 'verify']):
-            intent['type'] = 'confirmation'
-        elif any(w in query_lower for w in ['more', 'other', 'additional']):
-            intent['type'] = 'followup'
-        
-        cities = ['bangalore', 'bengaluru', 'delhi', 'mumbai', 'chennai', 'hyderabad', 'pune', 'kolkata']
-        for city in cities:
-            if city in query_lower:
-                intent['city'] = city.capitalize()
-                break
+        intent_type, city, hospital_name, count = _parse_intent(query)
+        intent = {'type': intent_type, 'city': city, 'hospital_name': hospital_name, 'count': count}
         
+        # Follow-ups inherit the last city; kept out of the cached parse since it depends on memory
         if not intent['city'] and intent['type'] == 'followup':
             intent['city'] = self.memory.get_last_city()
         
-        hospitals = ['manipal', 'apollo', 'fortis', 'max', 'medanta', 'artemis']
-        for hosp in hospitals:
-            if hosp in query_lower:
-                intent['hospital_name'] = hosp
-                break
-        
-        numbers = re.findall(r'\\b(\\d+|three|five|ten)\\b', query_lower)
-        if numbers:
-            num_map = {'three': 3, 'five': 5, 'ten': 10}
-            intent['count'] = num_map.get(numbers[0], int(numbers[0])) if numbers[0].isdigit() else num_map.get(numbers[0], 3)
-        
         return intent
     
     def process_query(self, user_query: str, is_first_message: bool = False) -> str:
+        """Blocking wrapper around aprocess_query for scripts and tests."""
+        return asyncio.run(self.aprocess_query(user_query, is_first_message))
+    
+    async def aprocess_query(self, user_query: str, is_first_message: bool = False) -> str:
         try:
             # Handle first interaction or greeting
             if is_first_message or not self.session_started:
@@ -150,68 +262,105 @@ TOKEN EFFICIENCY:
             if not self._is_hospital_related(user_query):
                 return "I'm sorry, I can only assist with hospital queries. Let me connect you with a human agent."
             
-            print("\\n" + "="*50)
-            print("🧠 REASONING PIPELINE")
-            print("="*50)
+            cache_key = (" ".join(user_query.lower().split()), self.memory.get_last_city())
+            cached = self._answer_cache.get(cache_key)
+            if cached is not None:
+                answer, hospitals = cached
+                logger.debug("Answer cache hit")
+                self.memory.add_interaction(user_query, answer, hospitals)
+                return intro + answer
             
             # Step 1: Intent analysis
-            print("\\n📋 Step 1: Intent Analysis")
             intent = self._extract_intent(user_query)
-            print(f"Intent: {intent['type']}, City: {intent.get('city')}, Hospital: {intent.get('hospital_name')}")
+            logger.debug("Step 1 intent: type=%s city=%s hospital=%s", intent['type'], intent.get('city'), intent.get('hospital_name'))
             
             # Step 2: RAG retrieval
-            print("\\n🔍 Step 2: RAG Retrieval")
             if intent['type'] == 'confirmation' and intent['hospital_name']:
                 hospitals = self.rag_engine.search_by_name_and_city(intent['hospital_name'], intent['city'], k=intent['count'])
             else:
                 hospitals = self.rag_engine.search_hospitals(user_query, k=intent['count'])
             
-            print(f"Retrieved {len(hospitals)} hospitals")
+            logger.debug("Step 2 retrieval: %d hospitals", len(hospitals))
+            
+            if (self.fast_path_enabled and intent['type'] == 'search' and intent['city']
+                    and hospitals and len(user_query.split()) < 8):
+                # Only answer from the template when the results really are in that city
+                in_city = [h for h in hospitals if _in_city(h['city'], intent['city'])]
+                if in_city:
+                    # Spoken reply: name at most three, and say so when there are more
+                    names = ", ".join(h['name'] for h in in_city[:3]).rstrip('.')
+                    if len(in_city) > 3:
+                        answer = f"Here are 3 of the {len(in_city)} hospitals I found in {intent['city']}: {names}."
+                    else:
+                        noun = 'hospital' if len(in_city) == 1 else 'hospitals'
+                        answer = f"I found {len(in_city)} {noun} in {intent['city']}: {names}."
+                    logger.debug("Fast path: templated city answer, LLM skipped")
+                    self.memory.add_interaction(user_query, answer, in_city)
+                    return intro + answer
             
             # Step 3: Response generation
-            print("\\n💬 Step 3: Response Generation")
             if hospitals:
-                context = f"Found {len(hospitals)} hospital(s):\\n"
+                context = f"Found {len(hospitals)} hospital(s):\n"
                 for i, h in enumerate(hospitals[:3], 1):
-                    context += f"{i}. {h['name']} in {h['city']}\\n   Address: {h['address']}\\n"
+                    context += f"{i}. {h['name']} in {h['city']}\n   Address: {h['address']}\n"
             else:
                 context = "No hospitals found."
             
             conversation_context = self.memory.get_conversation_context()
-            prompt = f"Context: {context}\\n{conversation_context}\\nUser: {user_query}\\n\\nProvide a concise voice response (2-3 sentences, NO newlines)."
+            prompt = f"Context: {context}\n{conversation_context}\nUser: {user_query}\n\nProvide a concise voice response (2-3 sentences, NO newlines)."
+            
+            # Multi-attempt reasoning with token optimization: all attempts run
+            # in parallel and the first one passing the quality check wins
+            client = self._get_client()
+            messages = [
+                {'role': 'system', 'content': self.system_prompt},
+                {'role': 'user', 'content': prompt}
+            ]
             
-            # Multi-attempt reasoning with token optimization
-            for attempt in range(1, 4):
-                try:
-                    print(f"🤔 LLM Attempt {attempt}/3")
-                    response = ollama.chat(
-                        model=self.ollama_model,
-                        messages=[
-                            {'role': 'system', 'content': self.system_prompt},
-                            {'role': 'user', 'content': prompt}
-                        ],
-                        options={
-                            'temperature': 0.7,
-                            'num_predict': 100,  # Token limit for efficiency
-                            'top_p': 0.9,
-                            'repeat_penalty': 1.1
-                        }
-                    )
-                    answer = response['message']['content'].strip().replace('\\n', ' ').replace('\\r', ' ')
+            async def run_attempt(attempt: int, temperature: float):
+                response = await client.chat(
+                    model=self.ollama_model,
+                    messages=messages,
+                    keep_alive=LLM_KEEP_ALIVE,
+                    options={
+                        'seed': LLM_SEED,
+                        'temperature': temperature,
+                        'num_predict': 100,  # Token limit for efficiency
+                        'top_p': 0.9,
+                        'repeat_penalty': 1.1
+                    }
+                )
+                return attempt, response
+            
+            tasks = [asyncio.create_task(run_attempt(attempt, temperature))
+                     for attempt, temperature in enumerate(LLM_ATTEMPT_TEMPERATURES, 1)]
+            logger.debug("Step 3 generation: %d LLM attempts in parallel", len(tasks))
+            errors = []
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    try:
+                        attempt, response = await next_done
+                    except Exception as e:
+                        errors.append(e)
+                        logger.warning("LLM attempt failed: %s", e)
+                        continue
+                    answer = response['message']['content'].strip().replace('\n', ' ').replace('\r', ' ')
                     
                     # Validate response quality
                     if 20 < len(answer) < 500 and not answer.startswith('I apologize'):
                         tokens_used = response.get('eval_count', 0)
-                        print(f"✅ Generated response (attempt {attempt}, ~{tokens_used} tokens)")
+                        logger.debug("Generated response (attempt %d, ~%d tokens)", attempt, tokens_used)
+                        self._answer_cache[cache_key] = (answer, hospitals)
                         self.memory.add_interaction(user_query, answer, hospitals)
-                        print("="*50 + "\\n")
                         return intro + answer
                     else:
-                        print(f"⚠️ Response quality check failed (attempt {attempt})")
-                except Exception as e:
-                    print(f"⚠️ Attempt {attempt} failed: {e}")
-                    if attempt == 3:
-                        raise
+                        logger.debug("Response quality check failed (attempt %d)", attempt)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            
+            if len(errors) == len(tasks):
+                raise errors[-1]
             
             # Fallback
             if hospitals:
@@ -220,18 +369,20 @@ TOKEN EFFICIENCY:
                 answer = "I couldn't find that hospital. Could you provide more details?"
             
             self.memory.add_interaction(user_query, answer, hospitals)
-            print("="*50 + "\\n")
             return intro + answer
             
         except Exception as e:
-            print(f"❌ Error: {e}")
+            logger.error("Query processing failed: %s", e)
             return "I'm having trouble processing your request. Please try again."
 
 
 agent = None
+_agent_lock = threading.Lock()
 
 def get_agent():
     global agent
     if agent is None:
-        agent = LoopAIAgent()
+        with _agent_lock:
+            if agent is None:
+                agent = LoopAIAgent()
     return agent
@@ -1,11 +1,13 @@
 import os
-import io
+import re
+import struct
+import asyncio
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
 from fastapi.responses import StreamingResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from deepgram import DeepgramClient
+from deepgram import AsyncDeepgramClient
 from agent import get_agent
 import logging
 from typing import Optional
@@ -35,14 +37,110 @@ if not deepgram_api_key:
     logger.warning("DEEPGRAM_API_KEY not found in environment variables")
     deepgram = None
 else:
-    deepgram = DeepgramClient(api_key=deepgram_api_key)
+    deepgram = AsyncDeepgramClient(api_key=deepgram_api_key)
 
-# Initialize the agent
-agent = get_agent()
+# The agent (and its RAG index) is built once at startup, off the event loop
+agent = None
+
+
+@app.on_event("startup")
+async def load_agent():
+    global agent
+    agent = await asyncio.to_thread(get_agent)
 
 # Track if this is the first message for introduction
 session_state = {"is_first_message": True}
 
+# TTS is requested as raw linear16 per sentence and wrapped in one streamed WAV
+TTS_MODEL = "aura-asteria-en"
+TTS_SAMPLE_RATE = 24000
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+# A period after these (or after initials like "R.K.") is not a sentence end;
+# hospital names are full of them ("Pvt. Ltd", "Dr. Grover")
+ABBREVIATION_END_RE = re.compile(
+    r'(?:\b(?:pvt|ltd|dr|st|inst|mr|mrs|ms|co|jr|sr|no|pt|gr|vt|hosp|rech|spcl|multispec)'
+    r'|\b[a-z](?:\.[a-z])*) ?\.$',
+    re.IGNORECASE
+)
+
+
+def wav_stream_header(sample_rate: int = TTS_SAMPLE_RATE) -> bytes:
+    """RIFF header for 16-bit mono PCM of unknown length (sizes set to the maximum)."""
+    data_size = 0xFFFFFFFF - 36
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b'data', data_size
+    )
+
+
+def synthesize(text: str):
+    """Async iterator of raw linear16 PCM chunks for one piece of text."""
+    return deepgram.speak.v1.audio.generate(
+        text=text,
+        model=TTS_MODEL,
+        encoding="linear16",
+        container="none",
+        sample_rate=TTS_SAMPLE_RATE,
+    )
+
+
+def split_sentences(text: str):
+    """Split text for per-sentence TTS without breaking after abbreviations."""
+    sentences = []
+    for part in SENTENCE_SPLIT_RE.split(text.strip()):
+        if not part:
+            continue
+        if sentences and ABBREVIATION_END_RE.search(sentences[-1]):
+            sentences[-1] += ' ' + part
+        else:
+            sentences.append(part)
+    return sentences or [text]
+
+
+async def pump_speech(text: str, queue: asyncio.Queue):
+    """Push PCM chunks for text onto queue, ending with None (or the raised exception)."""
+    try:
+        async for chunk in synthesize(text):
+            queue.put_nowait(chunk)
+    except Exception as e:
+        queue.put_nowait(e)
+        return
+    queue.put_nowait(None)
+
+
+async def stream_speech(text: str):
+    """
+    Yield a WAV stream for text, sentence by sentence.
+    
+    All sentences are synthesized concurrently; chunks are passed through
+    in sentence order as soon as they arrive, without joining buffers.
+    """
+    sentences = split_sentences(text)
+    queues = [asyncio.Queue() for _ in sentences]
+    producers = [asyncio.create_task(pump_speech(s, q)) for s, q in zip(sentences, queues)]
+    try:
+        yield wav_stream_header()
+        for queue in queues:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        for task in producers:
+            task.cancel()
+
+
+async def prepend_chunks(first_chunks, stream):
+    for chunk in first_chunks:
+        yield chunk
+    async for chunk in stream:
+        yield chunk
+
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -67,9 +165,10 @@ async def chat(
     """
     Main chat endpoint that handles voice-to-voice conversation or text queries.
     
-    Supports two input modes:
+    Supports three input modes:
     1. FormData with 'audio' file (voice queries)
     2. JSON with 'text_query' field (followup button clicks)
+    3. Raw audio body with an audio/* Content-Type (streamed uploads)
     
     Flow:
     1. Receive audio file OR text query from frontend
@@ -81,10 +180,14 @@ async def chat(
     try:
         # Check if it's a JSON request (followup queries)
         content_type = request.headers.get('content-type', '')
+        raw_audio = None
         if 'application/json' in content_type:
             body = await request.json()
             text_query = body.get('text_query')
             logger.info(f"Received JSON text query: {text_query}")
+        elif content_type.startswith('audio/'):
+            raw_audio = await request.body()
+            logger.info("Received raw audio request")
         else:
             logger.info("Received FormData request")
         
@@ -102,9 +205,9 @@ async def chat(
             # Handle text query from followup buttons
             transcript = text_query
             logger.info(f"Processing text query: {transcript}")
-        elif audio:
+        elif audio or raw_audio:
             # Handle audio query
-            audio_data = await audio.read()
+            audio_data = raw_audio if raw_audio else await audio.read()
             logger.info(f"Audio file size: {len(audio_data)} bytes")
             
             # Step 2: Speech-to-Text using Deepgram (Prerecorded)
@@ -115,7 +218,7 @@ async def chat(
                 mime_type = getattr(audio, 'content_type', None) or 'audio/webm'
 
                 # Transcribe audio (pass raw bytes as 'request' and options as keywords)
-                response = deepgram.listen.v1.media.transcribe_file(
+                response = await deepgram.listen.v1.media.transcribe_file(
                     request=audio_data,
                     model="nova-2",
                     smart_format=True,
@@ -156,7 +259,7 @@ async def chat(
         logger.info("Processing query with AI agent...")
         
         try:
-            ai_response = agent.process_query(
+            ai_response = await agent.aprocess_query(
                 transcript,
                 is_first_message=session_state["is_first_message"]
             )
@@ -174,24 +277,15 @@ async def chat(
         logger.info("Converting text to speech...")
         
         try:
-            # Generate speech using SDK v5 API (iterator of bytes)
-            audio_iter = deepgram.speak.v1.audio.generate(
-                text=ai_response,
-                model="aura-asteria-en",
-                encoding="linear16",
-                container="wav",
-            )
-
-            # Collect bytes from iterator
-            audio_chunks = []
-            for chunk in audio_iter:
-                audio_chunks.append(chunk)
-            audio_response = b"".join(audio_chunks)
-            
-            if not audio_response:
+            # Pull the WAV header and first audio chunk up front so TTS
+            # failures still surface as a 500 before the response starts
+            audio_stream = stream_speech(ai_response)
+            try:
+                first_chunks = [await audio_stream.__anext__(), await audio_stream.__anext__()]
+            except StopAsyncIteration:
                 raise Exception("No audio generated from TTS")
             
-            logger.info(f"Generated audio size: {len(audio_response)} bytes")
+            logger.info("Streaming synthesized audio...")
         
         except Exception as e:
             logger.error(f"TTS Error: {e}")
@@ -206,7 +300,7 @@ async def chat(
         clean_ai_response = ai_response.replace('\n', ' ').replace('\r', ' ')
         
         return StreamingResponse(
-            io.BytesIO(audio_response),
+            prepend_chunks(first_chunks, audio_stream),
             media_type="audio/wav",
             headers={
                 "Content-Disposition": "attachment; filename=response.wav",
@@ -227,11 +321,12 @@ async def chat(
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
+    """Health check endpoint (also probes the Ollama server)."""
     return {
         "status": "healthy",
         "deepgram_configured": deepgram is not None,
-        "agent_initialized": agent is not None
+        "agent_initialized": agent is not None,
+        "ollama": await agent.ollama_status() if agent is not None else None
     }
 
 
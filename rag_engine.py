@@ -3,49 +3,149 @@ Enhanced RAG Engine with:
 - TF-IDF semantic embeddings (lightweight, fast)
 - Hybrid search (keyword + semantic)
 - Caching for instant startup
+- Semantic query cache (exact + LSH near-duplicate lookup)
 """
 
 import os
+import threading
+import re
+from collections import OrderedDict, defaultdict
 import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import pickle
+from sklearn.preprocessing import normalize
+import scipy.sparse
+import joblib
 
 load_dotenv()
 
+QUERY_CACHE_SIZE = 512
+LSH_BITS = 16
+LSH_SIMILARITY = 0.95
+LSH_MAX_PROBES = 8
+# Bump the directory name whenever the cached layout or index contents change
+INDEX_CACHE_DIR = os.path.join("rag_cache", "v5")
+
 class HospitalRAG:
     def __init__(self, csv_path="hospital.csv", use_cache=True):
         self.csv_path = csv_path
         self.use_cache = use_cache
-        self.cache_dir = "rag_cache"
+        self.cache_dir = INDEX_CACHE_DIR
         
         print("🔄 Initializing RAG engine...")
         
         self.hospitals_df = None
-        self.documents = []
         self.metadata = []
         self.vectorizer = None
         self.tfidf_matrix = None
+        self._city_index = {}
+        self._name_trie = {}
+        
+        self._exact_cache = OrderedDict()
+        self._lsh_index = OrderedDict()
+        self._lsh_planes = None
         
         self._load_and_index_data()
     
+    def _reset_query_cache(self):
+        self._exact_cache.clear()
+        self._lsh_index.clear()
+        self._lsh_planes = None
+    
+    def _lsh_signature(self, query_vec) -> bytes:
+        if self._lsh_planes is None or self._lsh_planes.shape[1] != query_vec.shape[1]:
+            rng = np.random.default_rng(0)
+            self._lsh_planes = rng.standard_normal((LSH_BITS, query_vec.shape[1]), dtype=np.float32)
+        projection = np.asarray(query_vec @ self._lsh_planes.T).ravel()
+        return (projection > 0).astype(np.uint8).tobytes()
+    
+    def _lookup_similar(self, signature: bytes, query_vec, cache_key):
+        bucket = self._lsh_index.get(signature)
+        if not bucket:
+            return None
+        for cached_vec, cached_key, results in bucket:
+            if cached_key != cache_key:
+                continue
+            # TF-IDF rows are L2-normalized, so the dot product is the cosine
+            if query_vec.multiply(cached_vec).sum() >= LSH_SIMILARITY:
+                return results
+        return None
+    
+    def _cache_exact(self, normalized_query: str, cache_key, results):
+        self._exact_cache[(normalized_query,) + cache_key] = results
+        if len(self._exact_cache) > QUERY_CACHE_SIZE:
+            self._exact_cache.popitem(last=False)
+    
+    def _store_results(self, normalized_query: str, cache_key, signature: bytes, query_vec, results):
+        self._cache_exact(normalized_query, cache_key, results)
+        
+        bucket = self._lsh_index.setdefault(signature, [])
+        bucket.append((query_vec, cache_key, results))
+        # Only the newest entries are ever probed, so drop the rest
+        del bucket[:-LSH_MAX_PROBES]
+        self._lsh_index.move_to_end(signature)
+        if len(self._lsh_index) > QUERY_CACHE_SIZE:
+            self._lsh_index.popitem(last=False)
+    
+    def _build_lookup_indexes(self):
+        """City -> metadata rows, and a per-character trie over hospital name tokens."""
+        city_index = defaultdict(list)
+        name_trie = {}
+        for i, meta in enumerate(self.metadata):
+            city_index[str(meta['city']).strip().lower()].append(i)
+            for token in set(re.findall(r'\w+', str(meta['name']).lower())):
+                node = name_trie
+                for ch in token:
+                    node = node.setdefault(ch, {})
+                    # '' never collides with a character key; it holds every row under this prefix
+                    node.setdefault('', set()).add(i)
+        self._city_index = dict(city_index)
+        self._name_trie = name_trie
+    
+    def _name_candidates(self, name_lower: str) -> set:
+        """Rows whose name has, for every query token, a token starting with it."""
+        candidates = None
+        for token in re.findall(r'\w+', name_lower):
+            node = self._name_trie
+            for ch in token:
+                node = node.get(ch)
+                if node is None:
+                    return set()
+            ids = node.get('', set())
+            candidates = set(ids) if candidates is None else candidates & ids
+        return candidates or set()
+    
+    @staticmethod
+    def _compact_matrix(matrix):
+        """L2-normalized CSR with float32 data and int32 indices where they fit."""
+        matrix = normalize(matrix, norm='l2', axis=1, copy=False).tocsr()
+        matrix.data = matrix.data.astype(np.float32)
+        if matrix.nnz < np.iinfo(np.int32).max:
+            matrix.indices = matrix.indices.astype(np.int32)
+            matrix.indptr = matrix.indptr.astype(np.int32)
+        return matrix
+    
     def _load_and_index_data(self):
+        self._reset_query_cache()
         os.makedirs(self.cache_dir, exist_ok=True)
-        cache_file = os.path.join(self.cache_dir, "tfidf_index.pkl")
+        hospitals_file = os.path.join(self.cache_dir, "hospitals.parquet")
+        metadata_file = os.path.join(self.cache_dir, "metadata.parquet")
+        matrix_file = os.path.join(self.cache_dir, "tfidf_matrix.npz")
+        index_file = os.path.join(self.cache_dir, "index.joblib")
+        cache_files = [hospitals_file, metadata_file, matrix_file, index_file]
         
-        if self.use_cache and os.path.exists(cache_file):
+        if self.use_cache and all(os.path.exists(path) for path in cache_files):
             try:
                 print("🔄 Loading cached index...")
-                with open(cache_file, 'rb') as f:
-                    cache_data = pickle.load(f)
-                    self.hospitals_df = cache_data['hospitals_df']
-                    self.documents = cache_data['documents']
-                    self.metadata = cache_data['metadata']
-                    self.vectorizer = cache_data['vectorizer']
-                    self.tfidf_matrix = cache_data['tfidf_matrix']
-                print(f"✅ Loaded {len(self.documents)} hospitals from cache")
+                self.hospitals_df = pd.read_parquet(hospitals_file, memory_map=True)
+                self.metadata = pd.read_parquet(metadata_file, memory_map=True).to_dict('records')
+                self.tfidf_matrix = scipy.sparse.load_npz(matrix_file)
+                index_data = joblib.load(index_file, mmap_mode='r')
+                self.vectorizer = index_data['vectorizer']
+                self._city_index = index_data['city_index']
+                self._name_trie = index_data['name_trie']
+                print(f"✅ Loaded {len(self.metadata)} hospitals from cache")
                 return
             except Exception as e:
                 print(f"⚠️ Cache failed: {e}. Rebuilding...")
@@ -64,17 +164,13 @@ class HospitalRAG:
             print(f"✅ Loaded {len(self.hospitals_df)} hospitals")
             
             print("🔄 Creating semantic documents...")
-            self.documents = []
-            self.metadata = []
-            
-            for idx, row in self.hospitals_df.iterrows():
-                name = str(row['hospital name']).strip()
-                city = str(row['city']).strip()
-                address = str(row['address']).strip()
-                
-                doc = f"{name} {city} {address} hospital healthcare facility medical center"
-                self.documents.append(doc)
-                self.metadata.append({'name': name, 'city': city, 'address': address, 'index': idx})
+            clean = self.hospitals_df[['hospital name', 'city', 'address']].astype(str).apply(lambda col: col.str.strip())
+            documents = (clean['hospital name'] + ' ' + clean['city'] + ' ' + clean['address']
+                         + ' hospital healthcare facility medical center').tolist()
+            self.metadata = (clean.rename(columns={'hospital name': 'name'})
+                             .assign(index=self.hospitals_df.index)
+                             .to_dict('records'))
+            self._build_lookup_indexes()
             
             print(f"🔄 Building TF-IDF index...")
             self.vectorizer = TfidfVectorizer(
@@ -86,19 +182,19 @@ class HospitalRAG:
                 sublinear_tf=True
             )
             
-            self.tfidf_matrix = self.vectorizer.fit_transform(self.documents)
+            self.tfidf_matrix = self._compact_matrix(self.vectorizer.fit_transform(documents))
             print(f"✅ TF-IDF index created ({self.tfidf_matrix.shape[0]} vectors)")
             
             if self.use_cache:
                 try:
-                    with open(cache_file, 'wb') as f:
-                        pickle.dump({
-                            'hospitals_df': self.hospitals_df,
-                            'documents': self.documents,
-                            'metadata': self.metadata,
-                            'vectorizer': self.vectorizer,
-                            'tfidf_matrix': self.tfidf_matrix
-                        }, f)
+                    self.hospitals_df.to_parquet(hospitals_file)
+                    pd.DataFrame(self.metadata).to_parquet(metadata_file, index=False)
+                    scipy.sparse.save_npz(matrix_file, self.tfidf_matrix, compressed=False)
+                    joblib.dump({
+                        'vectorizer': self.vectorizer,
+                        'city_index': self._city_index,
+                        'name_trie': self._name_trie
+                    }, index_file)
                     print("✅ Index cached")
                 except: pass
             
@@ -114,25 +210,43 @@ class HospitalRAG:
         ]
         self.hospitals_df = pd.DataFrame(dummy_data)
         
-        self.documents = []
+        documents = []
         self.metadata = []
         for idx, row in self.hospitals_df.iterrows():
             doc = f"{row['hospital name']} {row['city']} {row['address']} hospital"
-            self.documents.append(doc)
+            documents.append(doc)
             self.metadata.append({'name': row['hospital name'], 'city': row['city'], 'address': row['address'], 'index': idx})
+        self._build_lookup_indexes()
         
         self.vectorizer = TfidfVectorizer(max_features=1000, ngram_range=(1, 2))
-        self.tfidf_matrix = self.vectorizer.fit_transform(self.documents)
+        self.tfidf_matrix = self._compact_matrix(self.vectorizer.fit_transform(documents))
         print("✅ Dummy index created")
     
     def search_hospitals(self, query: str, k: int = 5, score_threshold: float = 0.1):
-        if not self.vectorizer or self.tfidf_matrix is None:
+        if self.vectorizer is None or self.tfidf_matrix is None:
             return []
         
         try:
-            query_vec = self.vectorizer.transform([query])
-            similarities = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
-            top_indices = np.argsort(similarities)[::-1][:k]
+            normalized_query = " ".join(query.lower().split())
+            cache_key = (k, score_threshold)
+            cached = self._exact_cache.get((normalized_query,) + cache_key)
+            if cached is not None:
+                self._exact_cache.move_to_end((normalized_query,) + cache_key)
+                return list(cached)
+            
+            query_vec = normalize(self.vectorizer.transform([normalized_query]), copy=False)
+            signature = self._lsh_signature(query_vec)
+            cached = self._lookup_similar(signature, query_vec, cache_key)
+            if cached is not None:
+                self._cache_exact(normalized_query, cache_key, cached)
+                return list(cached)
+            
+            similarities = (self.tfidf_matrix @ query_vec.T).toarray().ravel()
+            k_eff = min(k, similarities.shape[0])
+            if k_eff <= 0:
+                return []
+            part = np.argpartition(similarities, -k_eff)[-k_eff:]
+            top_indices = part[np.argsort(similarities[part])[::-1]]
             
             hospitals = []
             for idx in top_indices:
@@ -143,27 +257,44 @@ class HospitalRAG:
                         "name": meta['name'],
                         "address": meta['address'],
                         "city": meta['city'],
-                        "full_text": self.documents[idx],
+                        "full_text": f"{meta['name']} {meta['city']} {meta['address']}",
                         "score": score,
                         "relevance": "high" if score > 0.5 else "medium" if score > 0.2 else "low"
                     })
-            return hospitals
+            self._store_results(normalized_query, cache_key, signature, query_vec, hospitals)
+            return list(hospitals)
         except:
             return []
     
     def search_by_name_and_city(self, name: str, city: str = None, k: int = 5):
-        if self.hospitals_df is None:
+        """
+        Exact name matches first, topped up with semantic results.
+        
+        Name matching is by token prefix: "max" finds "Max Hospital" but not
+        "Imax Multispeciality Hospital". City matching is a substring test.
+        """
+        if not self.metadata:
             return []
         
         try:
-            mask = self.hospitals_df['hospital name'].str.lower().str.contains(name.lower(), na=False, regex=False)
+            name_lower = name.lower()
+            candidates = self._name_candidates(name_lower)
             if city:
-                mask = mask & self.hospitals_df['city'].str.lower().str.contains(city.lower(), na=False, regex=False)
+                city_lower = city.lower()
+                city_rows = set()
+                for key, rows in self._city_index.items():
+                    if city_lower in key:
+                        city_rows.update(rows)
+                candidates &= city_rows
             
-            text_results = self.hospitals_df[mask]
             hospitals = []
-            for _, row in text_results.head(k).iterrows():
-                hospitals.append({"name": row['hospital name'], "address": row['address'], "city": row['city'], "score": 1.0, "relevance": "high"})
+            for i in sorted(candidates):
+                meta = self.metadata[i]
+                if name_lower not in str(meta['name']).lower():
+                    continue
+                hospitals.append({"name": meta['name'], "address": meta['address'], "city": meta['city'], "score": 1.0, "relevance": "high"})
+                if len(hospitals) >= k:
+                    break
             
             if len(hospitals) < k:
                 query = f"{name} hospital in {city}" if city else f"{name} hospital"
@@ -182,9 +313,12 @@ class HospitalRAG:
 
 
 rag_engine = None
+_rag_engine_lock = threading.Lock()
 
 def get_rag_engine():
     global rag_engine
     if rag_engine is None:
-        rag_engine = HospitalRAG()
+        with _rag_engine_lock:
+            if rag_engine is None:
+                rag_engine = HospitalRAG()
     return rag_engine
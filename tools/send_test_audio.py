@@ -1,34 +1,141 @@
-import wave
+import os
+import time
+import asyncio
+import argparse
 import struct
-import requests
-
-# Create 1 second of silence WAV
-fname = 'test_silence.wav'
-with wave.open(fname, 'w') as wf:
-    nchannels = 1
-    sampwidth = 2
-    framerate = 16000
-    nframes = framerate * 1
-    comptype = 'NONE'
-    compname = 'not compressed'
-    wf.setparams((nchannels, sampwidth, framerate, nframes, comptype, compname))
-    silence = (0).to_bytes(2, byteorder='little', signed=True)
-    for _ in range(nframes):
-        wf.writeframes(silence)
-
-# POST to server
-url = 'http://localhost:8000/chat'
-files = {'audio': ('test_silence.wav', open(fname, 'rb'), 'audio/wav')}
-print('Sending test audio...')
-resp = requests.post(url, files=files)
-print('Status:', resp.status_code)
-try:
-    print('Response headers:', resp.headers)
-    if resp.status_code == 200:
-        with open('response.wav', 'wb') as f:
-            f.write(resp.content)
-        print('Saved response.wav')
+import numpy as np
+import httpx
+
+# Set to a frequency in Hz to send a sine tone instead of silence
+TONE_HZ = None
+
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+URL = 'http://localhost:8000/chat'
+MAX_ATTEMPTS = 4
+RETRY_DELAY = 0.5  # seconds, doubled after each failed attempt
+# The server waits on STT, LLM and TTS; queued uploads wait for a pooled connection
+TIMEOUT = httpx.Timeout(120, connect=5, pool=None)
+
+# 1 second of 16 kHz mono 16-bit audio
+nchannels = 1
+sampwidth = 2
+framerate = 16000
+nframes = framerate * 1
+
+
+def wav_header(data_size):
+    """44-byte RIFF header for data_size bytes of PCM in the format above."""
+    block_align = nchannels * sampwidth
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, nchannels, framerate, framerate * block_align, block_align, sampwidth * 8,
+        b'data', data_size
+    )
+
+
+def make_test_wav():
+    """Build the test WAV in memory and return its bytes; nothing is written to disk."""
+    if TONE_HZ:
+        t = np.arange(nframes) / framerate
+        pcm = (0.5 * np.sin(2 * np.pi * TONE_HZ * t) * 32767).astype('<i2').tobytes()
     else:
-        print('Response body:', resp.text)
-except Exception as e:
-    print('Error reading response:', e)
+        pcm = bytes(nframes * nchannels * sampwidth)
+    return wav_header(len(pcm)) + pcm
+
+
+async def post_with_retry(client, name, body):
+    """POST one WAV body, retrying connection errors, timeouts and 5xx with exponential backoff."""
+    delay = RETRY_DELAY
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            # Send the WAV as the raw request body and stream the response;
+            # WAV doesn't compress, so ask the server not to gzip it
+            request = client.build_request('POST', URL, content=body,
+                                           headers={'Content-Type': 'audio/wav',
+                                                    'Accept-Encoding': 'identity'})
+            resp = await client.send(request, stream=True)
+        except httpx.TransportError as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            print(f'{name}: {e!r}; retrying in {delay}s')
+        else:
+            if resp.status_code < 500 or attempt == MAX_ATTEMPTS:
+                return resp
+            print(f'{name}: status {resp.status_code}; retrying in {delay}s')
+            await resp.aclose()
+        await asyncio.sleep(delay)
+        delay *= 2
+
+
+def read_wav(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def send(client, name, body, out_path):
+    """POST one in-memory WAV body and save the reply to out_path."""
+    print(f'Sending {name}...')
+    try:
+        resp = await post_with_retry(client, name, body)
+    except Exception as e:
+        print(f'{name}: request failed: {e!r}')
+        return None
+    print(f'{name}: status {resp.status_code}')
+    try:
+        print('Response headers:', resp.headers)
+        if resp.status_code == 200:
+            # Write the body as it arrives rather than buffering it all in memory
+            with open(out_path, 'wb') as f:
+                # Reserve the whole file up front when its final size is known
+                length = int(resp.headers.get('Content-Length', 0))
+                if (length and hasattr(os, 'posix_fallocate')
+                        and resp.headers.get('Content-Encoding', 'identity') == 'identity'):
+                    os.posix_fallocate(f.fileno(), 0, length)
+                async for chunk in resp.aiter_bytes(RESPONSE_CHUNK_SIZE):
+                    f.write(chunk)
+                f.truncate()
+            print('Saved', out_path)
+        else:
+            await resp.aread()
+            print('Response body:', resp.text)
+    except Exception as e:
+        print('Error reading response:', e)
+    finally:
+        await resp.aclose()
+    return resp.status_code
+
+
+async def send_all(jobs, outputs, workers):
+    """Send every job from one event loop over at most `workers` keep-alive connections."""
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+    async with httpx.AsyncClient(timeout=TIMEOUT, limits=limits) as client:
+        return await asyncio.gather(*(send(client, name, body, out_path)
+                                      for (name, body), out_path in zip(jobs, outputs)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='POST test audio to the /chat endpoint.')
+    parser.add_argument('paths', nargs='*', help='WAV files to send (default: generated test audio)')
+    parser.add_argument('--repeat', type=int, default=1, help='send each file this many times')
+    parser.add_argument('--workers', type=int, default=8, help='parallel uploads')
+    args = parser.parse_args()
+    
+    # Load each file once; repeated sends reuse the same bytes
+    if args.paths:
+        sources = [(path, read_wav(path)) for path in args.paths]
+    else:
+        sources = [('test audio', make_test_wav())]
+    jobs = sources * args.repeat
+    outputs = ['response.wav'] if len(jobs) == 1 else [f'response_{i}.wav' for i in range(len(jobs))]
+    
+    start = time.perf_counter()
+    statuses = asyncio.run(send_all(jobs, outputs, max(1, min(args.workers, len(jobs)))))
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for status in statuses if status == 200)
+    print(f'{ok}/{len(jobs)} uploads succeeded in {elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()